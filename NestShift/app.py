@@ -1,10 +1,15 @@
-from flask import Flask, request, render_template, send_file
+from flask import Flask, Response, request, render_template, send_file
 import requests
-import json
 import os
 import zipfile
 import gnupg
+import ijson
+import orjson
 import tempfile
+import uuid
+from http.cookiejar import DefaultCookiePolicy
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.utils import secure_filename
 
 app = Flask(__name__)
 
@@ -13,8 +18,28 @@ API_URL = "https://api.ridersguild.org/ProfileWebService.asmx/Export"
 GPG_PASSPHRASE = os.getenv("GPG_PASSPHRASE")
 PRIVATE_GPG_KEY_PATH = "/app/private-key.asc"   # Mounted inside container
 
+# Optional: when set, finished archives are moved here and served by nginx
+# through X-Accel-Redirect instead of being streamed by the Flask worker
+EXPORT_SPOOL_DIR = os.getenv("EXPORT_SPOOL_DIR")
+ACCEL_REDIRECT_PREFIX = os.getenv("ACCEL_REDIRECT_PREFIX", "/protected/")
+
+# Keys stripped from the export, wherever they appear in the tree
+SENSITIVE_KEYS = frozenset({"Password", "Sessions", "MMORoles"})
+
+API_ERROR_MESSAGES = {
+    401: "Unauthorized: Invalid username or password.",
+    500: "Server Error: Something went wrong on the server."
+}
+
+# Keep-alive connection pool to the API, shared by all requests in this worker.
+# Cookies are refused so nothing from one user's call leaks into the next.
+api_session = requests.Session()
+api_session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+
 # Initialize GPG and import private key once at startup
 gpg = gnupg.GPG()
+# Feed gpg's stdin in 256 KiB writes rather than python-gnupg's 16 KiB default
+gpg.buffer_size = 1 << 18
 
 with open(PRIVATE_GPG_KEY_PATH, "r") as keyfile:
     key_data = keyfile.read()
@@ -27,17 +52,70 @@ for fingerprint in import_result.fingerprints:
     gpg.trust_keys(fingerprint, 'TRUST_ULTIMATE')
 
 
-def remove_sensitive_keys(obj, keys_to_remove):
-    if isinstance(obj, dict):
-        return {
-            k: remove_sensitive_keys(v, keys_to_remove)
-            for k, v in obj.items()
-            if k not in keys_to_remove
-        }
-    elif isinstance(obj, list):
-        return [remove_sensitive_keys(item, keys_to_remove) for item in obj]
-    else:
-        return obj
+def sign_export(json_file, sig_file):
+    with open(json_file, "rb") as f:
+        return gpg.sign_file(
+            f,
+            keyid=None,
+            passphrase=GPG_PASSPHRASE,
+            detach=True,
+            output=sig_file,
+        )
+
+
+def write_filtered_json(stream, out, keys_to_remove):
+    # Re-emit the API's JSON as it is parsed, skipping any member whose key is
+    # sensitive, so the export never has to exist as a Python object tree.
+    # Output is indented by two spaces, matching orjson.OPT_INDENT_2.
+    indent = b"  "
+    has_members = []    # one flag per open container
+    after_key = False   # next value belongs to the key just written
+    skip_depth = None   # nesting depth inside a skipped value
+
+    for event, value in ijson.basic_parse(stream):
+        if skip_depth is not None:
+            if event in ("start_map", "start_array"):
+                skip_depth += 1
+            elif event in ("end_map", "end_array"):
+                skip_depth -= 1
+            if skip_depth == 0:
+                skip_depth = None
+            continue
+
+        if event == "map_key":
+            if value in keys_to_remove:
+                skip_depth = 0
+                continue
+            out.write((b",\n" if has_members[-1] else b"\n") + indent * len(has_members) + orjson.dumps(value) + b": ")
+            has_members[-1] = True
+            after_key = True
+            continue
+
+        if event in ("end_map", "end_array"):
+            if has_members.pop():
+                out.write(b"\n" + indent * len(has_members))
+            out.write(b"}" if event == "end_map" else b"]")
+            continue
+
+        if after_key:
+            after_key = False
+        elif has_members:
+            # Array element
+            out.write((b",\n" if has_members[-1] else b"\n") + indent * len(has_members))
+            has_members[-1] = True
+
+        if event == "start_map":
+            out.write(b"{")
+            has_members.append(False)
+        elif event == "start_array":
+            out.write(b"[")
+            has_members.append(False)
+        elif event == "number":
+            # ijson yields int/Decimal, whose str() keeps the API's exact digits
+            out.write(str(value).encode("ascii"))
+        else:
+            # string, boolean or null; orjson does the escaping in C
+            out.write(orjson.dumps(value))
 
 
 @app.route("/", methods=["GET", "POST"])
@@ -45,51 +123,56 @@ def export_form():
     if request.method == "POST":
         username = request.form.get("username")
         password = request.form.get("password")
+        # The username is user input; never let it shape paths or headers
+        export_name = secure_filename(username or "") or "account"
 
         try:
-            response = requests.post(API_URL, data={"username": username, "password": password})
-            if response.status_code != 200:
-                error_messages = {
-                    401: "Unauthorized: Invalid username or password.",
-                    500: "Server Error: Something went wrong on the server."
-                }
-                error_message = error_messages.get(response.status_code, f"API Error: Received status code {response.status_code}")
-                return render_template("index.html", error=error_message), response.status_code
-
-            data = response.json()
-
-            # Remove sensitive keys recursively
-            keys_to_remove = ["Password", "Sessions", "MMORoles"]
-            data = remove_sensitive_keys(data, keys_to_remove)
-
-            with tempfile.TemporaryDirectory() as temp_dir:
-                json_file = os.path.join(temp_dir, f"{username}_export.json")
-                sig_file = os.path.join(temp_dir, f"{username}_export.json.asc")
-                zip_file = os.path.join(temp_dir, f"{username}_export.zip")
-
-                with open(json_file, "w") as f:
-                    json.dump(data, f, indent=2)
-
-                with open(json_file, "rb") as f:
-                    signed_data = gpg.sign_file(
-                        f,
-                        keyid=None,
-                        passphrase=GPG_PASSPHRASE,
-                        detach=True,
-                        output=sig_file,
-                    )
-
-                if not signed_data:
-                    return render_template("index.html", error="Failed to sign the export file."), 500
-
-                with zipfile.ZipFile(zip_file, "w", zipfile.ZIP_DEFLATED) as zipf:
-                    zipf.write(json_file, os.path.basename(json_file))
-                    zipf.write(sig_file, os.path.basename(sig_file))
-
+            # Work inside the spool directory when offloading so the finished
+            # archive can be renamed into place without a copy
+            with tempfile.TemporaryDirectory(dir=EXPORT_SPOOL_DIR) as temp_dir:
+                json_file = os.path.join(temp_dir, f"{export_name}_export.json")
+                sig_file = os.path.join(temp_dir, f"{export_name}_export.json.asc")
+                zip_file = os.path.join(temp_dir, f"{export_name}_export.zip")
+
+                # Stream the body straight from the socket to disk, removing
+                # sensitive keys on the way
+                with api_session.post(API_URL, data={"username": username, "password": password}, stream=True) as response:
+                    if response.status_code != 200:
+                        error_message = API_ERROR_MESSAGES.get(response.status_code, f"API Error: Received status code {response.status_code}")
+                        return render_template("index.html", error=error_message), response.status_code
+
+                    response.raw.decode_content = True
+                    with open(json_file, "wb", buffering=1 << 18) as f:
+                        write_filtered_json(response.raw, f, SENSITIVE_KEYS)
+
+                # Signing runs in gpg while the JSON is deflated into the archive
+                with ThreadPoolExecutor(max_workers=1) as executor:
+                    signing = executor.submit(sign_export, json_file, sig_file)
+
+                    with zipfile.ZipFile(zip_file, "w", zipfile.ZIP_DEFLATED) as zipf:
+                        zipf.write(json_file, os.path.basename(json_file))
+
+                        signed_data = signing.result()
+                        if not signed_data:
+                            return render_template("index.html", error="Failed to sign the export file."), 500
+
+                        zipf.write(sig_file, os.path.basename(sig_file))
+
+                if EXPORT_SPOOL_DIR:
+                    spooled_name = f"{uuid.uuid4().hex}.zip"
+                    os.replace(zip_file, os.path.join(EXPORT_SPOOL_DIR, spooled_name))
+                    return Response(mimetype="application/zip", headers={
+                        "X-Accel-Redirect": f"{ACCEL_REDIRECT_PREFIX}{spooled_name}",
+                        "Content-Disposition": f"attachment; filename={export_name}_export.zip",
+                    })
+
+                # send_file opens the archive before the temp dir is removed; the
+                # open handle keeps it readable and goes out through the server's
+                # wsgi.file_wrapper, which gunicorn sends with sendfile(2)
                 return send_file(
                     zip_file,
                     as_attachment=True,
-                    download_name=f"{username}_export.zip",
+                    download_name=f"{export_name}_export.zip",
                     mimetype="application/zip",
                 )
 
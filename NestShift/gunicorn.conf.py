@@ -0,0 +1,10 @@
+import multiprocessing
+import os
+
+# Picked up automatically by gunicorn from the working directory (/app)
+bind = "0.0.0.0:21121"
+worker_class = "gthread"
+workers = int(os.getenv("GUNICORN_WORKERS", multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.getenv("GUNICORN_THREADS", "8"))
+# Large accounts take a while to fetch, sign and zip
+timeout = 120